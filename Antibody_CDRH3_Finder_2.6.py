@@ -0,0 +1,1645 @@
+#!/usr/bin/python
+
+"""
+Program: Antibody_CDRH3_Finder_2.6
+File: Antibody_CDRH3_Finder_2.6.py
+Version: 2.6
+Date: 19/10/2026
+Author: James Sweet-Jones (v1.0 - v2.5)
+        v2.6 additions by agent
+Address: Institute of Structural and Molecular Biology, Division of Biosciences, University College London
+#############################################################################
+Description:
+===========
+
+Takes in a number of paired Antibody light and heavy chains amino acid sequences in fasta format and outputs summary of chains
+
+#############################################################################
+
+Usage:
+=======
+
+Antibody_CDRH3_Finder_2.6.py [x] [options]
+
+where x is a fasta-formatted file where identifiers and sequences are wrapped or unwrapped
+e.g.
+>8E10_L|8E10 - (HUMAN) human
+EIVLTQSPGTLSLSPGERATLSCRASQSVSSSYLAW
+YQQKPGQAPRLLIYGASSRATGIPDRFSGSGSGTDF
+TLTISRLEPADFAVYYCQQYGSSPSITFGQGTRLEI
+KR
+>8E10_H|8E10 - (HUMAN) human
+QVQLVQSGAEVKKPGASVKVSCKASGYTFTSYAMHW
+VRQAPGQRLEWMGWINAGNGNTKYSQKFQGRVTITR
+DTSASTAYMELSSLRSEDTAVYYCARAMILRIGHGQ
+PQGYWGEGTLVT
+
+or
+
+>8E10_L|8E10 - (HUMAN) human
+EIVLTQSPGTLSLSPGERATLSCRASQSVSSSYLAWYQQKPGQAPRLLIYGASSRATGIPDRFSGSGSGTDFTLTISRLEPADFAVYYCQQYGSSPSITFGQGTRLEIKR
+>8E10_H|8E10 - (HUMAN) human
+QVQLVQSGAEVKKPGASVKVSCKASGYTFTSYAMHWVRQAPGQRLEWMGWINAGNGNTKYSQKFQGRVTITRDTSASTAYMELSSLRSEDTAVYYCARAMILRIGHGQPQGYWGEGTLVT
+
+
+Light and heavy chains must be noted in the identifiers with "L|" or "H|" where order of light/heavy chain does not matter.
+Identifiers passed "|" must be identical. All sequences in input fasta file must be paired in this format otherwise this version of the script won't work!
+
+[x] may be - to read the fasta file from stdin, e.g. zcat pairs.fa.gz | Antibody_CDRH3_Finder_2.6.py - > normal.fa
+Records are screened as they are read, normal pairs are written to stdout and messages to stderr.
+
+Light and heavy chains may instead be given as two separate fasta files with --light and --heavy, in any order.
+They are joined on the identifier passed "|" with a sort on disk, so the files do not need to fit in memory.
+
+Options:
+    --sample [n]            estimate the fraction of normal antibodies from n pairs at random offsets in [x]
+                            with a 95% confidence interval and exit, --seed [n] makes the sample repeatable
+    --light [file] --heavy [file]
+                            screen light and heavy chains from separate files in place of [x]
+    --temp-dir [dir]        where sorted runs are written while joining --light and --heavy
+    --output [file]         file normal pairs are written to, - for stdout
+                            (default Initial_screening_output.txt, or stdout when [x] is -)
+    --filtered [file]       file irregular pairs are written to (default Initial_screening_filtered_out.txt),
+                            e.g. /dev/fd/3 to write them to another file descriptor
+    --sidecar [file]        write the features extracted from each screened pair (cysteine count and positions,
+                            last tryptophan position, CDRH3 length, X count) to a fixed-width binary sidecar file
+    --from-sidecar [file]   reclassify pairs from a sidecar written by an earlier run instead of parsing [x] again.
+                            [x] must be the same file the sidecar was written from, it is only read to write out sequences
+    --max-cdrh3-length [n]  with --from-sidecar, CDRH3 loops up to n residues are normal whatever the distance
+                            between the heavy chain cysteines (default 8)
+    --cys-distance [min] [max]
+                            with --from-sidecar, distances between the heavy chain cysteines allowed when the
+                            CDRH3 is longer than --max-cdrh3-length (default 70 80)
+    --index                 write an identifier index of [x] to [x].idx and exit
+    --fetch [id ...]        print the light and heavy chains of every pair with each antibody identifier (first word
+                            after "|") from [x] using its index and exit, warning when an identifier names more than
+                            one pair. Works on the Initial_screening output files as well
+    --warnings-file [file]  write every pairing warning (unpaired, id mismatch, missing L|/H| tag, empty sequence,
+                            duplicate id, and with --light/--heavy no identifier and wrong chain file) to a tab
+                            separated file. Only counts and a few example identifiers are printed
+    --jobs [n]              screen batches of pairs in n worker processes (needs fork, so not on Windows)
+    --max-memory [size]     memory budget such as 800M or 4G for the whole run. It is shared between screening,
+                            the sorted runs of --light/--heavy, --duplicates fingerprints and buffered --database
+                            rows; workers are only started when they fit. The peak memory reached is reported at
+                            the end and the exit status is 1 if it was over the budget
+    --duplicates [report|drop]
+                            check that no identifier passed "|" is repeated for a chain type. Pairs that repeat
+                            one are counted as "duplicate id" warnings and, with drop, left out of both outputs
+    --database [file]       record each pair's verdict, failure reason and CDRH3 in a SQLite database. Pairs are
+                            keyed on the identifier they are paired on, so screening them again updates their rows
+    --clonotypes [file]     group normal antibodies into clonotypes of CDRH3s with the same length within
+                            --clonotype-distance [n] substitutions of each other (default 1) and write each
+                            antibody's CDRH3, clonotype number and clonotype size to a tab separated file
+
+
+#############################################################################
+Revision History:
+================
+
+v1.0 - took in inputs from command line
+v1.1 - takes in inputs from plain text file of heavy chains, one per line
+v2.0 - takes in fasta-formatted file of heavy and light chains and returns statistics about chains
+v2.2 - takes in fasta-formatted file of paired light and heavy chains and writes instances of normal heavy and light chains to output file.
+        statistics about chains are printed to display
+v2.3 - takes in wrapped or unwrapped fasta-formatted file of paired light and heavy chains and writes pairs normal heavy and light chains to output file.
+v2.4 - improved stringency on identifying paired sequences
+v2.5 - takes in fasta format file of paired heavy and light chains where order does not matter
+v2.6 - optional binary sidecar of per-pair chain features so pairs can be reclassified without parsing fasta again
+        identifier index of fasta files so pairs can be fetched by identifier without a full scan
+        pairing warnings are counted by category and summarised at the end instead of printed per record
+        input is parsed incrementally without an intermediate file and can be read from stdin with output to stdout
+        optional batch screening in worker processes sized to fit a memory budget
+        optional CDRH3 clonotype grouping of normal antibodies
+        takes in light and heavy chains from separate fasta files joined on their identifiers
+        sampled estimate of the normal fraction with a confidence interval
+        optional duplicate identifier check using fixed-width fingerprints with a Bloom filter pass for large files
+        optional SQLite store of verdicts, failure reasons and CDRH3s across runs
+"""
+#############################################################################
+#Import libraries
+
+import sys
+import re
+import os
+import argparse
+import collections
+import signal
+import multiprocessing
+import tempfile
+import heapq
+import random
+import math
+import hashlib
+import array
+import sqlite3
+import time
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+import struct
+import mmap
+
+#############################################################################
+
+def unwrapped_fasta(f, record_offsets=None, max_record_bytes=None):
+    """
+    Input: f                --- a fasta file opened in binary mode that may be either wrapped or unwrapped, e.g. sys.stdin.buffer
+           record_offsets   --- optional list or deque that (byte offset, byte length) of each record is appended to
+           max_record_bytes --- optional limit on the size of a single record
+    Return: generator of lines alternating identifier line and unwrapped sequence line, both ending in "\n".
+            Each record is given out as soon as the next identifier is read so input can be screened as it arrives
+    30/10/20 Original by JSJ
+    19/10/2026 Reads the input incrementally instead of writing an unwrapped intermediate file, by agent
+    """
+
+    header = None
+    sequence = []
+    start = position = 0
+    for line in f:
+        if line[:1] == b">":
+            if header is not None:
+                if record_offsets is not None:
+                    record_offsets.append((start, position - start))
+                yield header.decode().rstrip("\r\n") + "\n"
+                yield b"".join(sequence).decode() + "\n"
+            header = line
+            sequence = []
+            start = position
+        elif header is not None:
+            sequence.append(line.rstrip(b"\r\n"))
+            if max_record_bytes and position - start > max_record_bytes:
+                sys.exit("ERROR: record " + header.decode().strip() + " does not fit in --max-memory")
+        position += len(line)
+    if header is not None:
+        if record_offsets is not None:
+            record_offsets.append((start, position - start))
+        yield header.decode().rstrip("\r\n") + "\n"
+        yield b"".join(sequence).decode() + "\n"
+
+##############################################################################
+def Heavy_Chain_Identifier(x):
+    """
+
+    Input: x --- An antibody heavy chain amino acid sequence
+    Return: true if chain is normal, false if not
+
+    23/10/2020 Original by JSJ
+    """
+
+    k = len(x)
+    Number_of_cysteines = 0
+    CAR = 0
+    First_Cys_motif_start_position = 0
+    Second_Cys_motif_start_position = 0
+    WG = 0
+    WG_position = 0
+    CDRH3_loop = ""
+    Max_CDRH3_insertions = 8
+
+    #Define number and location of cysteine residues in sequence and if the distance between residues is within expected range
+    for i in range(k):
+        if x[i] == "C" and Number_of_cysteines == 0:
+            Number_of_cysteines += 1
+            First_Cys_motif_start_position = i+1
+            continue
+        elif x[i] == "C" and Number_of_cysteines == 1:
+            Second_Cys_motif_start_position = i+1
+            Number_of_cysteines += 1
+        elif x[i] == "C" and Number_of_cysteines >1:
+            Number_of_cysteines += 1
+    Cys_distance = Second_Cys_motif_start_position - First_Cys_motif_start_position
+
+    #Define number and location of tryptophan residues in sequence and locate the last tryptophan
+
+    W_positions = []
+    for i in range(Second_Cys_motif_start_position-1, k):
+        if x[i] == "W":
+            W_positions.append(i+1)
+
+    #Define CDRH3 loop by printing all residues between second cysteine residue +2 and final tryptophan residue
+
+    if len(W_positions) > 0:
+        WG_position = W_positions[-1]
+        for i in range(Second_Cys_motif_start_position+2, WG_position-1):
+            CDRH3_loop = CDRH3_loop + x[i]
+
+        #Calculates number of inserted bases by subtracting length of CDRH3 by length of CDRH3 without insertions (8)
+    len_CDRH3 = len(CDRH3_loop)
+    CDRH3_insertion_length = len(CDRH3_loop) - Max_CDRH3_insertions
+    CDRH3_insertion = ""
+    CDRH3_insertion_modulus = len(CDRH3_insertion)
+    if CDRH3_insertion_length != 0:
+        for i in range(WG_position-3-CDRH3_insertion_length, WG_position-3):
+            CDRH3_insertion = CDRH3_insertion + x[i]
+
+    #Print out results
+
+    if Number_of_cysteines != 2:
+        return False
+    elif CDRH3_insertion_modulus > 9:
+        return False
+    elif len_CDRH3 == 0:
+        return False
+    elif Number_of_cysteines == 2 and CDRH3_insertion_length <= 0:
+        return True
+    elif len(W_positions) == 0:
+        return False
+    elif Number_of_cysteines == 2 and 70 <= Cys_distance <= 80:
+        return True
+    else:
+        return False
+
+#############################################################################
+def Light_Chain_Identifier(x):
+    """
+
+    Input: x --- An antibody light chain amino acid sequence in one letter format
+    Return: true if chain is normal, false if not
+
+    28/10/2020 Original by JSJ
+    """
+    k = len(x)
+    Number_of_cysteines = 0
+    First_Cys_motif_start_position = 0
+    Second_Cys_motif_start_position = 0
+    #Define number and location of cysteine residues in sequence and if the distance between residues is within expected range
+    for i in range(k):
+        if x[i] == "C" and Number_of_cysteines == 0:
+            Number_of_cysteines += 1
+            First_Cys_motif_start_position = i+1
+            continue
+        elif x[i] == "C" and Number_of_cysteines == 1:
+            Second_Cys_motif_start_position = i+1
+            Number_of_cysteines += 1
+        elif x[i] == "C" and Number_of_cysteines >1:
+            Number_of_cysteines += 1
+        else:
+            continue
+    Cys_distance = Second_Cys_motif_start_position - First_Cys_motif_start_position
+    if Number_of_cysteines == 2 and Cys_distance:
+        return True
+    else:
+        return False
+
+#############################################################################
+def chain_features(x):
+    """
+
+    Input: x --- An antibody chain amino acid sequence with X residues already removed
+    Return: tuple of (number of cysteines, first cysteine position, second cysteine position,
+            last tryptophan position from the second cysteine onwards, CDRH3 length)
+            positions count from 1 and are 0 when the residue is not found, as in Heavy_Chain_Identifier,
+            and the CDRH3 length is 0 without a second cysteine to measure it from
+
+    19/10/2026 Original by agent
+    """
+
+    Number_of_cysteines = x.count("C")
+    First_Cys_motif_start_position = x.find("C") + 1
+    Second_Cys_motif_start_position = 0
+    if Number_of_cysteines > 1:
+        Second_Cys_motif_start_position = x.find("C", First_Cys_motif_start_position) + 1
+    WG_position = x.rfind("W", max(Second_Cys_motif_start_position-1, 0)) + 1
+    len_CDRH3 = 0
+    if Second_Cys_motif_start_position > 0 and WG_position > 0:
+        len_CDRH3 = max(WG_position - Second_Cys_motif_start_position - 3, 0)
+    return (Number_of_cysteines, First_Cys_motif_start_position, Second_Cys_motif_start_position, WG_position, len_CDRH3)
+
+#############################################################################
+def features_are_normal(light_features, heavy_features, Max_CDRH3_insertions=8, Min_Cys_distance=70, Max_Cys_distance=80):
+    """
+
+    Input: light_features, heavy_features --- tuples from chain_features()
+    Return: true if both chains are normal by the same rules as Light_Chain_Identifier and Heavy_Chain_Identifier
+
+    19/10/2026 Original by agent
+    """
+
+    return not failure_reason(light_features, heavy_features, Max_CDRH3_insertions, Min_Cys_distance, Max_Cys_distance)
+
+def failure_reason(light_features, heavy_features, Max_CDRH3_insertions=8, Min_Cys_distance=70, Max_Cys_distance=80):
+    """
+
+    Input: light_features, heavy_features --- tuples from chain_features()
+    Return: why the pair is not normal by the rules of Light_Chain_Identifier and Heavy_Chain_Identifier,
+            "" if both chains are normal
+
+    19/10/2026 Original by agent
+    """
+
+    light_cysteines, light_first_cys, light_second_cys = light_features[:3]
+    heavy_cysteines, heavy_first_cys, heavy_second_cys, WG_position, len_CDRH3 = heavy_features
+    if light_cysteines != 2 or light_second_cys == light_first_cys:
+        return "light chain has %d cysteines" % light_cysteines
+    if heavy_cysteines != 2:
+        return "heavy chain has %d cysteines" % heavy_cysteines
+    if len_CDRH3 == 0:
+        return "no CDRH3 loop found"
+    if len_CDRH3 <= Max_CDRH3_insertions or Min_Cys_distance <= heavy_second_cys - heavy_first_cys <= Max_Cys_distance:
+        return ""
+    return "CDRH3 of %d residues with heavy chain cysteines %d apart" % (len_CDRH3, heavy_second_cys - heavy_first_cys)
+
+#############################################################################
+# Sidecar files start with SIDECAR_MAGIC and SIDECAR_HEADER, the size and modification time in nanoseconds of
+# the input they were written from (both 0 when it was read from stdin), followed by one fixed-width little
+# endian row per screened pair:
+# light record offset and length, heavy record offset and length (bytes in the original input),
+# light cysteines, first cys, second cys, X count,
+# heavy cysteines, first cys, second cys, last W, CDRH3 length, X count
+SIDECAR_MAGIC = b"ABSIDE01"
+SIDECAR_HEADER = struct.Struct("<QQ")
+SIDECAR_ROW = struct.Struct("<QIQIHIIIHIIIII")
+
+def input_fingerprint(path):
+    """
+    Input: path --- input fasta file, - for stdin
+    Return: (size in bytes, modification time in nanoseconds) of the file, (0, 0) for stdin
+    """
+    if path == "-":
+        return 0, 0
+    status = os.stat(path)
+    return status.st_size, status.st_mtime_ns
+
+def fasta_records(path):
+    """
+
+    Input: path --- a fasta file that may be either wrapped or unwrapped
+    Return: generator of (byte offset, byte length, identifier line) for every record in the file, in file order
+
+    19/10/2026 Original by agent
+    """
+
+    record = None
+    position = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if line[:1] == b">":
+                if record:
+                    yield record[0], position - record[0], record[1]
+                record = (position, line)
+            position += len(line)
+    if record:
+        yield record[0], position - record[0], record[1]
+
+def read_fasta_record(f, offset, length):
+    """
+
+    Input: f      --- fasta file opened in binary mode
+           offset --- byte offset of the record's ">"
+           length --- byte length of the record
+    Return: identifier line and unwrapped sequence line, both ending in "\n" as in the intermediate file
+
+    19/10/2026 Original by agent
+    """
+
+    f.seek(offset)
+    record = f.read(length).decode(errors="replace").replace("\r\n", "\n")
+    if record[:1] != ">" or "\n" not in record:
+        sys.exit("ERROR: no fasta record at byte %d of %s, has it changed since its index or sidecar was written?" % (offset, f.name))
+    header, sequence = record.split("\n", 1)
+    return header + "\n", sequence.replace("\n", "") + "\n"
+
+def write_sidecar_row(sidecar, light_record, heavy_record, light_chain, heavy_chain):
+    """
+
+    Input: sidecar      --- sidecar file opened in binary mode
+           light_record --- (offset, length) of the light chain record in the input
+           heavy_record --- (offset, length) of the heavy chain record in the input
+           light_chain, heavy_chain --- sequences as read from the input, X residues included
+    Return: None, one row is appended to the sidecar
+
+    19/10/2026 Original by agent
+    """
+
+    light_features = chain_features(re.sub('X', '', light_chain.strip()))
+    heavy_features = chain_features(re.sub('X', '', heavy_chain.strip()))
+    sidecar.write(SIDECAR_ROW.pack(light_record[0], light_record[1], heavy_record[0], heavy_record[1],
+                                   *light_features[:3], light_chain.count("X"),
+                                   *heavy_features, heavy_chain.count("X")))
+
+def reclassify_from_sidecar(sidecar_path, input_path, output, filtered, Max_CDRH3_insertions=8, Min_Cys_distance=70, Max_Cys_distance=80):
+    """
+
+    Input: sidecar_path --- sidecar written by an earlier run with --sidecar
+           input_path   --- the fasta file the sidecar was written from
+           output, filtered --- open output files for normal and irregular pairs
+           Max_CDRH3_insertions, Min_Cys_distance, Max_Cys_distance --- rules passed to features_are_normal()
+    Return: number of normal and irregular antibodies
+
+    Verdicts come from the stored features alone, the input is only seeked into to copy out sequences.
+
+    19/10/2026 Original by agent
+    """
+
+    Normal_antibodies = 0
+    Irregular_antibodies = 0
+    header_size = len(SIDECAR_MAGIC) + SIDECAR_HEADER.size
+    with open(sidecar_path, "rb") as s, open(input_path, "rb") as f:
+        if os.fstat(s.fileno()).st_size < header_size:
+            sys.exit("ERROR: " + sidecar_path + " is not a sidecar file")
+        rows = mmap.mmap(s.fileno(), 0, access=mmap.ACCESS_READ)
+        if rows[:len(SIDECAR_MAGIC)] != SIDECAR_MAGIC or (len(rows) - header_size) % SIDECAR_ROW.size:
+            sys.exit("ERROR: " + sidecar_path + " is not a sidecar file")
+        written_from = SIDECAR_HEADER.unpack_from(rows, len(SIDECAR_MAGIC))
+        if written_from != (0, 0) and written_from != input_fingerprint(input_path):
+            sys.exit("ERROR: " + sidecar_path + " was not written from " + input_path + " as it is now, write the sidecar again")
+        view = memoryview(rows)[header_size:] # rows are unpacked straight out of the mapping without copying the file
+        for row in SIDECAR_ROW.iter_unpack(view):
+            light_features = row[4:7]
+            heavy_features = row[8:13]
+            light_chain_identifier, light_chain = read_fasta_record(f, row[0], row[1])
+            heavy_chain_identifier, heavy_chain = read_fasta_record(f, row[2], row[3])
+            if features_are_normal(light_features, heavy_features, Max_CDRH3_insertions, Min_Cys_distance, Max_Cys_distance):
+                output.write(light_chain_identifier)
+                output.write(re.sub('X','',light_chain))
+                output.write(heavy_chain_identifier)
+                output.write(re.sub('X','',heavy_chain))
+                Normal_antibodies += 1
+            else:
+                filtered.write(light_chain_identifier)
+                filtered.write(light_chain)
+                filtered.write(heavy_chain_identifier)
+                filtered.write(heavy_chain)
+                Irregular_antibodies += 1
+        view.release()
+        rows.close()
+    return Normal_antibodies, Irregular_antibodies
+
+#############################################################################
+# Index files list one record per line as "identifier<tab>chain<tab>offset<tab>length", sorted by identifier
+# so a lookup is a binary search of seeks over the index rather than a scan of the fasta file.
+# The identifier is the first word after "|" and chain is L or H.
+
+def antibody_id(identifier_line):
+    """
+    Input: identifier_line --- fasta identifier line of a light or heavy chain
+    Return: first word after "|", or "" if there is none
+    """
+    identifier = identifier_line.split("|", 1)[1].split() if "|" in identifier_line else []
+    return identifier[0] if identifier else ""
+
+def index_path(path):
+    """
+    Input: path --- a fasta file
+    Return: path of its identifier index
+    """
+    return path + ".idx"
+
+def build_index(path):
+    """
+
+    Input: path --- a fasta file of paired light and heavy chains, e.g. an input or an Initial_screening output
+    Return: number of records indexed, the index is written to index_path(path)
+
+    19/10/2026 Original by agent
+    """
+
+    entries = []
+    for offset, length, header in fasta_records(path):
+        header = header.decode()
+        if re.search(r'L\|', header):
+            chain = "L"
+        elif re.search(r'H\|', header):
+            chain = "H"
+        else:
+            continue
+        identifier = antibody_id(header)
+        if not identifier:
+            continue
+        entries.append((identifier, chain, offset, length))
+    entries.sort(key=lambda entry: (entry[0].encode(), entry[2])) # byte order, as compared in fetch_antibody, then file order
+    with open(index_path(path), "w") as index:
+        for entry in entries:
+            index.write("%s\t%s\t%d\t%d\n" % entry)
+    return len(entries)
+
+def fetch_antibody(path, identifier):
+    """
+
+    Input: path       --- a fasta file indexed with build_index
+           identifier --- first word after "|" of the antibody to fetch
+    Return: list of dictionaries of chain ("L"/"H") to (identifier line, unwrapped sequence line), one per pair
+            whose first word after "|" is identifier, in file order, empty if not found
+
+    19/10/2026 Original by agent
+    """
+
+    if not os.path.exists(index_path(path)) or os.path.getmtime(index_path(path)) < os.path.getmtime(path):
+        sys.exit("ERROR: index for " + path + " is missing or out of date, rebuild it with --index")
+    key = identifier.encode()
+    pairs = {} # pairing_key(): chains, as several pairs can share a first word
+    with open(index_path(path), "rb") as index, open(path, "rb") as f:
+        index.seek(0, 2)
+        low, high = 0, index.tell()
+        while low < high: # find the first line starting at or after low whose identifier is >= key
+            middle = (low + high) // 2
+            index.seek(middle - 1 if middle else 0)
+            if middle:
+                index.readline()
+            line = index.readline()
+            if line and line.split(b"\t", 1)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        index.seek(low - 1 if low else 0)
+        if low:
+            index.readline()
+        for line in index:
+            line_key, chain, offset, length = line.split(b"\t")
+            if line_key != key:
+                break
+            record = read_fasta_record(f, int(offset), int(length))
+            pairs.setdefault(pairing_key(record[0]), {})[chain.decode()] = record
+    return list(pairs.values())
+
+#############################################################################
+# Pairing warnings are counted by category instead of printed per record, keeping a few example identifiers
+# for the summary. Every warning can also be written to a tab separated side file.
+WARNING_CATEGORIES = ("unpaired", "id mismatch", "missing L|/H| tag", "no identifier", "wrong chain file", "empty sequence",
+                      "duplicate id")
+Max_warning_samples = 5
+
+def new_diagnostics(details_path=None):
+    """
+
+    Input: details_path --- optional file to write every warning to
+    Return: dictionary holding warning counts, sample identifiers and the open details file
+
+    19/10/2026 Original by agent
+    """
+
+    diagnostics = {"counts": dict.fromkeys(WARNING_CATEGORIES, 0),
+                   "samples": {category: [] for category in WARNING_CATEGORIES},
+                   "details": None}
+    if details_path:
+        diagnostics["details"] = open(details_path, "w")
+        diagnostics["details"].write("category\tidentifier\tdetail\n")
+    return diagnostics
+
+def record_warning(diagnostics, category, identifier, detail=""):
+    """
+
+    Input: diagnostics --- dictionary from new_diagnostics()
+           category    --- one of WARNING_CATEGORIES
+           identifier  --- identifier of the offending record
+           detail      --- identifier lines involved, written to the details file only
+    Return: None
+
+    19/10/2026 Original by agent
+    """
+
+    identifier = identifier.strip()
+    diagnostics["counts"][category] += 1
+    if len(diagnostics["samples"][category]) < Max_warning_samples:
+        diagnostics["samples"][category].append(identifier)
+    if diagnostics["details"]:
+        diagnostics["details"].write(category + "\t" + identifier + "\t" + detail.replace("\n", " ").strip() + "\n")
+
+def print_diagnostics_summary(diagnostics, out=sys.stdout):
+    """
+
+    Input: diagnostics --- dictionary from new_diagnostics()
+           out         --- where to print the summary
+    Return: None, the details file is closed
+
+    19/10/2026 Original by agent
+    """
+
+    if diagnostics["details"]:
+        diagnostics["details"].close()
+    if not any(diagnostics["counts"].values()):
+        return
+    print("WARNING: pairing problems found", file=out)
+    for category in WARNING_CATEGORIES:
+        count = diagnostics["counts"][category]
+        if count:
+            samples = ", ".join(diagnostics["samples"][category])
+            if count > len(diagnostics["samples"][category]):
+                samples += ", ..."
+            print("    %-18s %d  (%s)" % (category + ":", count, samples), file=out)
+    if diagnostics["details"]:
+        print("    every warning is listed in", diagnostics["details"].name, file=out)
+
+#############################################################################
+def pairing_key(identifier_line):
+    """
+    Input: identifier_line --- fasta identifier line of a light or heavy chain
+    Return: identifier between the first and second "|" that light and heavy chains are paired on, "" if there is none
+    """
+    identifier_line_split = identifier_line.split("|")
+    return identifier_line_split[1].strip() if len(identifier_line_split) > 1 else ""
+
+def paired_records(input, diagnostics, max_record_bytes=None):
+    """
+
+    Input: input       --- a fasta file of paired light and heavy chains opened in binary mode
+           diagnostics --- dictionary from new_diagnostics() that pairing warnings are recorded in
+           max_record_bytes --- optional limit on the size of a single record
+    Return: generator of (light identifier line, light chain, heavy identifier line, heavy chain,
+            light (offset, length), heavy (offset, length)) for each adjacent light/heavy pair
+            with identical identifiers passed "|", in either order. A record that does not pair is reported
+            and the record after it starts the next pair, so no record goes unaccounted for
+
+    30/10/2020 Pairing loop original by JSJ in the main program
+    19/10/2026 Moved into a function by agent
+    """
+
+    record_offsets = collections.deque(maxlen=1) # byte offset and length of the record just read
+    f = unwrapped_fasta(input, record_offsets, max_record_bytes)
+    records = ((line, next(f), record_offsets[0]) for line in f) # (identifier line, sequence line, (offset, length))
+    record = next(records, None)
+    while record is not None: # a record that fails to pair is reported and the one after it starts the next pair
+        identifier, sequence, offsets = record
+        if not re.search(r'[LH]\|', identifier):
+            record_warning(diagnostics, "missing L|/H| tag", identifier[1:], identifier)
+            record = next(records, None)
+            continue
+        other_tag = r'H\|' if re.search(r'L\|', identifier) else r'L\|'
+        identifier_split_check = pairing_key(identifier)
+        record = next(records, None)
+        if record is None or not re.search(other_tag, record[0]):
+            record_warning(diagnostics, "unpaired", identifier_split_check, identifier + (record[0] if record else ""))
+            continue
+        if identifier_split_check != pairing_key(record[0]):
+            record_warning(diagnostics, "id mismatch", identifier_split_check, identifier + record[0])
+            continue
+        if other_tag == r'H\|':
+            pair = identifier, sequence, record[0], record[1], offsets, record[2]
+        else:
+            pair = record[0], record[1], identifier, sequence, record[2], offsets
+        if not pair[1].strip() or not pair[3].strip():
+            record_warning(diagnostics, "empty sequence", identifier_split_check, identifier + record[0])
+        yield pair
+        record = next(records, None)
+
+#############################################################################
+# Sampled estimate of the normal fraction. Random byte offsets are seeked to, the reader moves forward to the
+# next identifier line and the pair starting there (or at the record after it) is screened. Offsets land in
+# records in proportion to their length, which is close to uniform over pairs as chain lengths vary little.
+
+def records_from(f, count):
+    """
+
+    Input: f     --- fasta file opened in binary mode, positioned anywhere
+           count --- number of records to read
+    Return: list of up to count (offset, length in the file, identifier line, unwrapped sequence line) starting at
+            the next identifier line
+
+    19/10/2026 Original by agent
+    """
+
+    records = []
+    ends = []
+    while True:
+        offset = f.tell()
+        line = f.readline()
+        if not line:
+            break
+        if line[:1] == b">":
+            if records:
+                ends.append(offset)
+            if len(records) == count:
+                break
+            records.append([offset, line.decode().rstrip("\r\n") + "\n", []])
+        elif records:
+            records[-1][2].append(line.decode().rstrip("\r\n"))
+    ends = (ends + [offset])[:len(records)] # the last record read ends at the next identifier or the end of the file
+    return [(start, end - start, header, "".join(sequence) + "\n") for (start, header, sequence), end in zip(records, ends)]
+
+def is_pair(first_identifier, second_identifier):
+    """
+
+    Input: first_identifier, second_identifier --- identifier lines of two adjacent records
+    Return: true if one is a light and the other a heavy chain with identical identifiers passed "|"
+
+    19/10/2026 Original by agent
+    """
+
+    if "|" not in first_identifier or "|" not in second_identifier:
+        return False
+    if not (re.search(r'L\|', first_identifier) and re.search(r'H\|', second_identifier)) and \
+       not (re.search(r'H\|', first_identifier) and re.search(r'L\|', second_identifier)):
+        return False
+    return pairing_key(first_identifier) == pairing_key(second_identifier)
+
+def sample_normal_fraction(path, sample_size, seed=None):
+    """
+
+    Input: path        --- fasta file of paired light and heavy chains
+           sample_size --- number of pairs to screen
+           seed        --- optional random seed
+    Return: (pairs screened, normal pairs, mean bytes per pair)
+
+    19/10/2026 Original by agent
+    """
+
+    file_size = os.path.getsize(path)
+    rng = random.Random(seed)
+    seen = set()
+    normal = 0
+    pair_bytes = 0
+    attempts = 0
+    with open(path, "rb") as f:
+        while len(seen) < sample_size and attempts < 20 * sample_size and file_size:
+            attempts += 1
+            offset = rng.randrange(file_size)
+            f.seek(offset - 1 if offset else 0)
+            if offset and f.read(1) != b"\n":
+                f.readline() # move to the start of the next line unless the offset is already at one
+            records = records_from(f, 3)
+            for first, second in zip(records, records[1:]):
+                if is_pair(first[2], second[2]):
+                    break
+            else:
+                continue
+            if first[0] in seen: # the same pair was found from another offset
+                continue
+            seen.add(first[0])
+            light, heavy = (first, second) if re.search(r'L\|', first[2]) else (second, first)
+            normal += screen_batch([(light[3], heavy[3])])[0]
+            pair_bytes += first[1] + second[1] # bytes on disk, line wrapping included
+    return len(seen), normal, pair_bytes / len(seen) if seen else 0
+
+def wilson_interval(successes, trials, z=1.96):
+    """
+
+    Input: successes, trials --- counts from a sample
+           z                 --- standard normal quantile, 1.96 for a 95% interval
+    Return: (lower, upper) Wilson score confidence interval for the proportion
+
+    19/10/2026 Original by agent
+    """
+
+    if trials == 0:
+        return 0.0, 1.0
+    p = successes / trials
+    centre = (p + z * z / (2 * trials)) / (1 + z * z / trials)
+    half_width = z * math.sqrt(p * (1 - p) / trials + z * z / (4 * trials * trials)) / (1 + z * z / trials)
+    return max(0.0, centre - half_width), min(1.0, centre + half_width)
+
+#############################################################################
+# Separate light and heavy chain files are paired with an external sort-merge join: each file is read in
+# runs that fit in memory, every run is sorted on pairing_key() and written to a temporary file,
+# then the runs are merged back in identifier order and the two sorted streams are walked side by side.
+Default_run_bytes = 256 * 1024 * 1024
+Max_merge_runs = 64 # runs merged at once, more are first merged into longer runs to limit open files
+Record_overhead = 256 # python tuple, three strings and list slot held for every record sorted in memory
+
+def write_run(records, directory):
+    """
+
+    Input: records   --- list of (pairing_key(), identifier line, sequence line)
+           directory --- directory to write the run to
+    Return: path of the run file, records sorted by identifier as three lines each
+
+    19/10/2026 Original by agent
+    """
+
+    records.sort(key=lambda record: record[0])
+    with tempfile.NamedTemporaryFile("w", dir=directory, suffix=".run", delete=False) as run:
+        for key, header, sequence in records:
+            run.write(key + "\n" + header + sequence)
+    return run.name
+
+def read_run(path):
+    """
+
+    Input: path --- run file from write_run()
+    Return: generator of (pairing_key(), identifier line, sequence line)
+
+    19/10/2026 Original by agent
+    """
+
+    with open(path) as run:
+        for key in run:
+            yield key[:-1], next(run), next(run)
+
+def sorted_records(path, directory, run_bytes):
+    """
+
+    Input: path      --- fasta file of light or heavy chains, wrapped or unwrapped
+           directory --- directory for temporary run files
+           run_bytes --- memory for the records sorted at a time, python object overhead included
+    Return: generator of (pairing_key(), identifier line, sequence line) sorted by identifier
+
+    19/10/2026 Original by agent
+    """
+
+    runs = []
+    records = []
+    size = 0
+    with open(path, "rb") as f:
+        lines = unwrapped_fasta(f, None, run_bytes)
+        for header in lines:
+            sequence = next(lines)
+            key = pairing_key(header)
+            records.append((key, header, sequence))
+            size += len(key) + len(header) + len(sequence) + Record_overhead
+            if size >= run_bytes:
+                runs.append(write_run(records, directory))
+                records = []
+                size = 0
+    if not runs: # everything fitted in memory
+        records.sort(key=lambda record: record[0])
+        yield from records
+        return
+    if records:
+        runs.append(write_run(records, directory))
+    while len(runs) > Max_merge_runs:
+        merged = []
+        for i in range(0, len(runs), Max_merge_runs):
+            with tempfile.NamedTemporaryFile("w", dir=directory, suffix=".run", delete=False) as run:
+                for key, header, sequence in heapq.merge(*[read_run(r) for r in runs[i:i+Max_merge_runs]], key=lambda record: record[0]):
+                    run.write(key + "\n" + header + sequence)
+            for r in runs[i:i+Max_merge_runs]:
+                os.remove(r)
+            merged.append(run.name)
+        runs = merged
+    yield from heapq.merge(*[read_run(r) for r in runs], key=lambda record: record[0])
+
+def joined_records(light_path, heavy_path, diagnostics, run_bytes=Default_run_bytes, directory=None):
+    """
+
+    Input: light_path, heavy_path --- fasta files of light chains and of heavy chains, in any order
+           diagnostics            --- dictionary from new_diagnostics() that pairing warnings are recorded in
+           run_bytes              --- bytes of each file sorted in memory at a time, see plan_memory()
+           directory              --- directory for temporary run files, default the system temporary directory
+    Return: generator of pairs in the same form as paired_records(), in identifier order.
+            Record offsets are not kept for a join and are given as (0, 0). Headers need no L|/H| tag as the
+            file gives the chain type, but a record tagged as the other chain type is reported and not joined
+
+    19/10/2026 Original by agent
+    """
+
+    with tempfile.TemporaryDirectory(dir=directory) as directory:
+        lights = sorted_records(light_path, directory, run_bytes)
+        heavies = sorted_records(heavy_path, directory, run_bytes)
+        light = next(lights, None)
+        heavy = next(heavies, None)
+        while light or heavy:
+            if light and not light[0]: # "" sorts first, records without a "|" cannot be paired
+                record_warning(diagnostics, "no identifier", light[1][1:], light[1])
+                light = next(lights, None)
+            elif heavy and not heavy[0]:
+                record_warning(diagnostics, "no identifier", heavy[1][1:], heavy[1])
+                heavy = next(heavies, None)
+            elif light and re.search(r'H\|', light[1]) and not re.search(r'L\|', light[1]):
+                record_warning(diagnostics, "wrong chain file", light[0], light[1])
+                light = next(lights, None)
+            elif heavy and re.search(r'L\|', heavy[1]) and not re.search(r'H\|', heavy[1]):
+                record_warning(diagnostics, "wrong chain file", heavy[0], heavy[1])
+                heavy = next(heavies, None)
+            elif heavy is None or (light and light[0] < heavy[0]):
+                record_warning(diagnostics, "unpaired", light[0], light[1])
+                light = next(lights, None)
+            elif light is None or heavy[0] < light[0]:
+                record_warning(diagnostics, "unpaired", heavy[0], heavy[1])
+                heavy = next(heavies, None)
+            else:
+                if not light[2].strip() or not heavy[2].strip():
+                    record_warning(diagnostics, "empty sequence", light[0], light[1] + heavy[1])
+                yield light[1], light[2], heavy[1], heavy[2], (0, 0), (0, 0)
+                light = next(lights, None)
+                heavy = next(heavies, None)
+
+#############################################################################
+# Duplicate identifier check. Each chain's identifier after "|" is reduced to a 64-bit fingerprint and kept in
+# an open addressing table of fixed-width integers, 8 bytes per slot rather than a python string per identifier.
+# The table is kept between three eighths and three quarters full, so it costs about 11-21 bytes per identifier,
+# and three times as much while it is being doubled. It is sized up front from the expected number of identifiers
+# when that is known so it does not need to grow. For large input files a first pass through a Bloom filter finds
+# the few fingerprints that may occur more than once, and only those are kept in the table during screening.
+Bloom_prestage_bytes = 1024 ** 3 # input files larger than this get the Bloom filter first pass
+Bloom_bits_per_identifier = 10   # about 1% false positives with Bloom_hashes
+Bloom_hashes = 7
+Bytes_per_identifier = 150       # at least this many bytes of fasta per identifier, to size the Bloom filter
+
+def duplicate_key(chain, identifier_line):
+    """
+    Input: chain           --- "L" or "H", from the record's place in its pair or the file it was read from
+           identifier_line --- fasta identifier line of a light or heavy chain
+    Return: chain type and pairing_key()
+    """
+    return chain + "\t" + pairing_key(identifier_line)
+
+def fingerprint(key):
+    """
+    Input: key --- string
+    Return: non-zero 64-bit fingerprint of key
+    """
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little") or 1
+
+def new_fingerprint_set(expected=0, max_bytes=None):
+    """
+
+    Input: expected  --- number of fingerprints the table should hold without growing
+           max_bytes --- optional limit on the memory the table may grow to
+    Return: dictionary holding an array of 64-bit slots (0 is empty), the number of fingerprints stored and the limit
+
+    19/10/2026 Original by agent
+    """
+
+    capacity = 1024
+    while capacity * 3 < expected * 4 and (not max_bytes or 16 * capacity <= max_bytes):
+        capacity *= 2
+    return {"table": array.array("Q", [0]) * capacity, "count": 0, "max_bytes": max_bytes}
+
+def fingerprint_add(fingerprints, value):
+    """
+
+    Input: fingerprints --- dictionary from new_fingerprint_set()
+           value        --- fingerprint from fingerprint()
+    Return: true if value was already in the set, otherwise it is added and false is returned
+
+    19/10/2026 Original by agent
+    """
+
+    table = fingerprints["table"]
+    mask = len(table) - 1
+    i = value & mask
+    while table[i]: # linear probing
+        if table[i] == value:
+            return True
+        i = (i + 1) & mask
+    table[i] = value
+    fingerprints["count"] += 1
+    if fingerprints["count"] * 4 > len(table) * 3: # keep the table under three quarters full
+        old_table = table
+        if fingerprints["max_bytes"] and 24 * len(old_table) > fingerprints["max_bytes"]: # old and new table together
+            sys.exit("ERROR: the duplicate check needs more than its share of --max-memory, %d identifiers so far" % fingerprints["count"])
+        fingerprints["table"] = array.array("Q", [0]) * (2 * len(old_table))
+        fingerprints["count"] = 0
+        for old_value in old_table:
+            if old_value:
+                fingerprint_add(fingerprints, old_value)
+    return False
+
+def fingerprint_contains(fingerprints, value):
+    """
+
+    Input: fingerprints --- dictionary from new_fingerprint_set()
+           value        --- fingerprint from fingerprint()
+    Return: true if value is in the set
+
+    19/10/2026 Original by agent
+    """
+
+    table = fingerprints["table"]
+    mask = len(table) - 1
+    i = value & mask
+    while table[i]:
+        if table[i] == value:
+            return True
+        i = (i + 1) & mask
+    return False
+
+def bloom_prestage(sources, max_bytes=None):
+    """
+
+    Input: sources   --- (fasta file, chain type) that will be screened, chain type "L" for a --light file,
+                         "H" for a --heavy file and None for paired input, where it is taken from the L|/H| tag
+           max_bytes --- optional memory limit for the Bloom filter and the candidate fingerprints
+    Return: fingerprint set of every identifier the Bloom filter has seen before, a superset of the duplicates
+
+    19/10/2026 Original by agent
+    """
+
+    bits = max(Bloom_bits_per_identifier * sum(os.path.getsize(path) for path, chain in sources) // Bytes_per_identifier, 8)
+    if max_bytes:
+        bits = max(min(bits, 8 * (max_bytes // 2)), 8) # fewer bits only means more false candidates
+    bloom = bytearray(bits // 8 + 1)
+    candidates = new_fingerprint_set(max_bytes=max_bytes // 2 if max_bytes else None)
+    for path, file_chain in sources:
+        with open(path, "rb") as f:
+            for line in f:
+                if line[:1] != b">":
+                    continue
+                line = line.decode()
+                chain = file_chain
+                if chain is None: # tagged as paired_records() tells light from heavy, untagged records never pair
+                    chain = "L" if re.search(r'L\|', line) else "H" if re.search(r'H\|', line) else None
+                    if chain is None:
+                        continue
+                key = duplicate_key(chain, line)
+                digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+                h1 = int.from_bytes(digest[:8], "little")
+                h2 = int.from_bytes(digest[8:], "little") | 1
+                seen = True
+                for i in range(Bloom_hashes):
+                    bit = (h1 + i * h2) % bits
+                    if not bloom[bit >> 3] & (1 << (bit & 7)):
+                        seen = False
+                        bloom[bit >> 3] |= 1 << (bit & 7)
+                if seen:
+                    fingerprint_add(candidates, fingerprint(key))
+    return candidates
+
+def new_duplicate_check(sources, max_bytes=None):
+    """
+
+    Input: sources   --- (fasta file, chain type) that will be screened as for bloom_prestage(), [] when reading stdin
+           max_bytes --- optional memory limit for the fingerprint tables
+    Return: dictionary for is_duplicate(), with a Bloom filter first pass over paths when they are large
+
+    19/10/2026 Original by agent
+    """
+
+    candidates = None
+    input_bytes = sum(os.path.getsize(path) for path, chain in sources)
+    if input_bytes > Bloom_prestage_bytes:
+        candidates = bloom_prestage(sources, max_bytes // 2 if max_bytes else None)
+        max_bytes = max_bytes // 2 if max_bytes else None
+        expected = candidates["count"] # only candidates are ever added
+    else:
+        expected = input_bytes // Bytes_per_identifier
+    return {"candidates": candidates, "seen": new_fingerprint_set(expected, max_bytes)}
+
+def is_duplicate(check, chain, identifier_line):
+    """
+
+    Input: check           --- dictionary from new_duplicate_check()
+           chain           --- "L" or "H", from the chain's place in its pair
+           identifier_line --- identifier line of a light or heavy chain being screened
+    Return: true if the same chain type and identifier passed "|" has already been screened
+
+    19/10/2026 Original by agent
+    """
+
+    value = fingerprint(duplicate_key(chain, identifier_line))
+    if check["candidates"] is not None and not fingerprint_contains(check["candidates"], value):
+        return False # the Bloom filter only saw this identifier once
+    return fingerprint_add(check["seen"], value)
+
+def unique_pairs(pairs, check, diagnostics, drop=False):
+    """
+
+    Input: pairs       --- generator of pairs from paired_records() or joined_records()
+           check       --- dictionary from new_duplicate_check()
+           diagnostics --- dictionary from new_diagnostics() that repeated identifiers are recorded in
+           drop        --- true to leave out pairs that repeat an identifier
+    Return: generator of the pairs, checked before they are screened so dropped pairs are never classified
+
+    19/10/2026 Original by agent
+    """
+
+    for pair in pairs:
+        light_duplicate = is_duplicate(check, "L", pair[0])
+        if is_duplicate(check, "H", pair[2]) or light_duplicate:
+            record_warning(diagnostics, "duplicate id", pairing_key(pair[0]), pair[0] + pair[2])
+            if drop:
+                continue
+        yield pair
+
+def duplicate_check_bytes(check):
+    """
+    Input: check --- dictionary from new_duplicate_check()
+    Return: bytes used by the fingerprint tables
+    """
+    tables = [check["seen"]] + ([check["candidates"]] if check["candidates"] is not None else [])
+    return sum(len(fingerprints["table"]) * 8 for fingerprints in tables)
+
+#############################################################################
+# SQLite result store. One row per pair keyed on pairing_key(), the identifier light and heavy chains are paired
+# on, so screening the same pair again updates its row instead of adding another. The first word passed "|", as
+# for --fetch, is kept in an indexed column but is not unique. Rows are written with one prepared
+# statement in transactions of Database_batch_rows, and rows whose results have not changed are left untouched.
+Database_batch_rows = 50000
+
+DATABASE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS screening (
+    pairing_key      TEXT PRIMARY KEY,
+    antibody_id      TEXT NOT NULL,
+    light_identifier TEXT NOT NULL,
+    heavy_identifier TEXT NOT NULL,
+    verdict          TEXT NOT NULL,
+    reason           TEXT NOT NULL,
+    light_cysteines  INTEGER,
+    heavy_cysteines  INTEGER,
+    cys_distance     INTEGER,
+    cdrh3            TEXT,
+    cdrh3_length     INTEGER,
+    source           TEXT,
+    screened_at      TEXT
+);
+CREATE INDEX IF NOT EXISTS screening_antibody_id ON screening (antibody_id);
+CREATE INDEX IF NOT EXISTS screening_verdict ON screening (verdict);
+CREATE INDEX IF NOT EXISTS screening_cdrh3_length ON screening (cdrh3_length);
+"""
+
+DATABASE_UPSERT = """
+INSERT INTO screening VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (pairing_key) DO UPDATE SET
+    antibody_id = excluded.antibody_id, light_identifier = excluded.light_identifier, heavy_identifier = excluded.heavy_identifier,
+    verdict = excluded.verdict, reason = excluded.reason, light_cysteines = excluded.light_cysteines,
+    heavy_cysteines = excluded.heavy_cysteines, cys_distance = excluded.cys_distance, cdrh3 = excluded.cdrh3,
+    cdrh3_length = excluded.cdrh3_length, source = excluded.source, screened_at = excluded.screened_at
+WHERE (verdict, reason, cdrh3, light_identifier, heavy_identifier) IS NOT
+      (excluded.verdict, excluded.reason, excluded.cdrh3, excluded.light_identifier, excluded.heavy_identifier)
+"""
+
+def open_database(path):
+    """
+
+    Input: path --- SQLite database file, created if it does not exist
+    Return: connection with the screening table and its indexes in place, in WAL mode
+
+    19/10/2026 Original by agent
+    """
+
+    database = sqlite3.connect(path)
+    database.execute("PRAGMA journal_mode=WAL")
+    database.execute("PRAGMA synchronous=NORMAL")
+    database.executescript(DATABASE_SCHEMA)
+    return database
+
+def database_row(pair, normal, source, screened_at):
+    """
+
+    Input: pair        --- pair from paired_records() or joined_records()
+           normal      --- true if both chains are normal
+           source      --- input file(s) the pair was read from
+           screened_at --- time of the run
+    Return: row of the screening table for the pair
+
+    19/10/2026 Original by agent
+    """
+
+    light_chain_identifier, light_chain, heavy_chain_identifier, heavy_chain = pair[:4]
+    light_features = chain_features(re.sub('X','',light_chain.strip()))
+    heavy_chain_removed_dels = re.sub('X','',heavy_chain.strip())
+    heavy_features = chain_features(heavy_chain_removed_dels)
+    reason = "" if normal else failure_reason(light_features, heavy_features)
+    cys_distance = cdrh3 = None # NULL when the heavy chain has no second cysteine to measure from
+    if heavy_features[2]:
+        cys_distance = heavy_features[2] - heavy_features[1]
+        cdrh3 = CDRH3_sequence(heavy_chain_removed_dels)
+    return (pairing_key(light_chain_identifier), antibody_id(light_chain_identifier), light_chain_identifier[1:].strip(), heavy_chain_identifier[1:].strip(),
+            "normal" if normal else "irregular", reason, light_features[0], heavy_features[0],
+            cys_distance, cdrh3, heavy_features[4], source, screened_at)
+
+def write_database_rows(database, rows):
+    """
+
+    Input: database --- connection from open_database()
+           rows     --- list of rows from database_row(), emptied once written
+    Return: None, the rows are upserted in one transaction
+
+    19/10/2026 Original by agent
+    """
+
+    with database:
+        database.executemany(DATABASE_UPSERT, rows)
+    del rows[:]
+
+#############################################################################
+# Batch screening. Pairs are grouped into batches by size in bytes rather than by count, so batches of long
+# sequences hold fewer pairs, and only a bounded number of batches are in flight between the reader and the
+# worker processes. With --max-memory the number of workers, batches in flight and the batch size are all
+# chosen to fit the budget.
+Batch_overhead = 4              # python objects, pickled copy sent to the worker and the worker's copy of a batch
+Min_batch_bytes = 64 * 1024
+Max_batch_bytes = 16 * 1024 * 1024
+Default_batch_bytes = 1024 * 1024
+Database_row_bytes = 1024       # a buffered database row with its python objects
+
+def parse_memory_size(size):
+    """
+
+    Input: size --- memory size such as 4000000, 512K, 800M or 1.5G
+    Return: size in bytes, at least 1
+
+    19/10/2026 Original by agent
+    """
+
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+    size = size.strip().upper().rstrip("B")
+    try:
+        if size and size[-1] in units:
+            size_bytes = int(float(size[:-1]) * units[size[-1]])
+        else:
+            size_bytes = int(size)
+    except (ValueError, OverflowError):
+        sys.exit("ERROR: cannot read memory size " + size)
+    if size_bytes < 1:
+        sys.exit("ERROR: memory size " + size + " must be at least 1 byte")
+    return size_bytes
+
+def peak_memory():
+    """
+
+    Input: None
+    Return: peak resident memory in bytes of this process and of the largest finished worker process
+
+    19/10/2026 Original by agent
+    """
+
+    if resource is None:
+        return 0, 0
+    scale = 1 if sys.platform == "darwin" else 1024 # ru_maxrss is in bytes on macOS, kilobytes elsewhere
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale)
+
+def plan_memory(max_memory, jobs, join=False, database=False, duplicates=False):
+    """
+
+    Input: max_memory --- memory budget in bytes for the whole run, or None
+           jobs       --- number of worker processes asked for
+           join, database, duplicates --- true when --light/--heavy, --database or --duplicates are used
+    Return: dictionary of how the budget is shared out: worker processes ("jobs", 1 screens in this process),
+            batches in flight, batch size and largest record in bytes, bytes of sorted run held in memory for
+            each joined file, database rows buffered before they are written, and bytes for duplicate fingerprints
+
+    Once this process is counted, the join gets half of what is left, duplicate fingerprints a quarter and
+    buffered database rows a sixteenth when they are used. Screening gets the rest, and worker processes are
+    only started if a whole copy of this process and two batches each still fit in it.
+
+    19/10/2026 Original by agent
+    """
+
+    plan = {"jobs": jobs, "in_flight": 2 * jobs, "batch_bytes": Default_batch_bytes, "record_bytes": None,
+            "run_bytes": Default_run_bytes, "database_rows": Database_batch_rows, "duplicate_bytes": None}
+    if not max_memory:
+        return plan
+    process_bytes = peak_memory()[0] # every forked worker is counted as a whole copy of this process
+    available = max_memory - process_bytes
+    if available < Min_batch_bytes * Batch_overhead:
+        sys.exit("ERROR: --max-memory is too small, this process alone uses %d MB" % (process_bytes // 1024 ** 2))
+    join_bytes = available // 2 if join else 0
+    duplicate_bytes = available // 4 if duplicates else 0
+    database_bytes = available // 16 if database else 0
+    screening_bytes = available - join_bytes - duplicate_bytes - database_bytes
+    plan["run_bytes"] = join_bytes // 2 # runs of both files can be in memory at once
+    plan["duplicate_bytes"] = duplicate_bytes
+    plan["database_rows"] = max(1, min(Database_batch_rows, database_bytes // Database_row_bytes))
+    plan["jobs"] = 1
+    plan["record_bytes"] = screening_bytes // Batch_overhead
+    while jobs > 1:
+        batch_bytes = (screening_bytes - process_bytes * jobs) // (2 * jobs * Batch_overhead)
+        if batch_bytes >= Min_batch_bytes:
+            plan["jobs"] = jobs
+            plan["in_flight"] = 2 * jobs
+            plan["batch_bytes"] = plan["record_bytes"] = min(batch_bytes, Max_batch_bytes)
+            break
+        jobs -= 1
+    return plan
+
+def screen_batch(batch):
+    """
+
+    Input: batch --- list of (light chain, heavy chain) sequences
+    Return: list of true/false, true where both chains are normal
+
+    19/10/2026 Original by agent
+    """
+
+    return [Light_Chain_Identifier(re.sub('X','',light_chain)) and Heavy_Chain_Identifier(re.sub('X','',heavy_chain))
+            for light_chain, heavy_chain in batch]
+
+def screen_pairs(pairs, plan, log=sys.stdout):
+    """
+
+    Input: pairs --- generator of pairs from paired_records()
+           plan  --- dictionary from plan_memory(), with 1 job pairs are screened in this process
+           log   --- where to report the batch plan
+    Return: generator of (pair, true if both chains are normal) in input order
+
+    19/10/2026 Original by agent
+    """
+
+    jobs, in_flight, batch_bytes = plan["jobs"], plan["in_flight"], plan["batch_bytes"]
+    if jobs <= 1:
+        for pair in pairs:
+            yield pair, screen_batch([(pair[1], pair[3])])[0]
+        return
+    print("Screening in", jobs, "worker processes with", in_flight, "batches of up to", batch_bytes // 1024, "KB in flight", file=log)
+    pool = multiprocessing.get_context("fork").Pool(jobs)
+    pending = collections.deque()
+    batch = []
+    size = 0
+    for pair in pairs:
+        batch.append(pair)
+        size += len(pair[1]) + len(pair[3])
+        if size >= batch_bytes:
+            pending.append((batch, pool.apply_async(screen_batch, ([(p[1], p[3]) for p in batch],))))
+            batch = []
+            size = 0
+            if len(pending) >= in_flight: # wait for the oldest batch before reading any further
+                done, result = pending.popleft()
+                yield from zip(done, result.get())
+    if batch:
+        pending.append((batch, pool.apply_async(screen_batch, ([(p[1], p[3]) for p in batch],))))
+    while pending:
+        done, result = pending.popleft()
+        yield from zip(done, result.get())
+    pool.close()
+    pool.join()
+
+def check_memory(max_memory, jobs, out=sys.stdout):
+    """
+
+    Input: max_memory --- memory budget in bytes
+           jobs       --- worker processes used, 1 when screening ran in this process
+           out        --- where to print the report
+    Return: true if the peak memory measured is within the budget, a warning is printed if not
+
+    19/10/2026 Original by agent
+    """
+
+    main_peak, worker_peak = peak_memory()
+    total_peak = main_peak + (worker_peak * jobs if jobs > 1 else 0)
+    print("Peak memory: %.1f MB main process, %.1f MB largest worker, %.1f MB in total, budget %.1f MB"
+          % (main_peak / 1024 ** 2, worker_peak / 1024 ** 2, total_peak / 1024 ** 2, max_memory / 1024 ** 2), file=out)
+    if total_peak > max_memory:
+        print("WARNING: peak memory was over the --max-memory budget", file=out)
+        return False
+    return True
+
+#############################################################################
+def CDRH3_sequence(x):
+    """
+
+    Input: x --- An antibody heavy chain amino acid sequence with X residues removed
+    Return: CDRH3 loop as defined in Heavy_Chain_Identifier, residues between the second cysteine +2
+            and the final tryptophan, "" if there is none
+
+    19/10/2026 Original by agent
+    """
+
+    Number_of_cysteines, First_Cys_motif_start_position, Second_Cys_motif_start_position, WG_position, len_CDRH3 = chain_features(x)
+    if len_CDRH3 == 0:
+        return ""
+    return x[Second_Cys_motif_start_position+2:WG_position-1]
+
+def within_hamming_distance(a, b, distance):
+    """
+
+    Input: a, b     --- sequences of equal length
+           distance --- largest number of mismatches allowed
+    Return: true if a and b differ at no more than distance positions
+
+    19/10/2026 Original by agent
+    """
+
+    mismatches = 0
+    for residue_a, residue_b in zip(a, b):
+        if residue_a != residue_b:
+            mismatches += 1
+            if mismatches > distance:
+                return False
+    return True
+
+def group_clonotypes(loops, distance=1):
+    """
+
+    Input: loops    --- list of CDRH3 sequences
+           distance --- largest Hamming distance between CDRH3s of the same length in one clonotype
+    Return: list of clonotype numbers, starting at 1 in order of first appearance, one per loop
+
+    CDRH3s are linked when they have the same length and are within distance of each other, and clonotypes
+    are the linked groups. For distance 1, loops that are the same once position p is left out are neighbours,
+    so each loop is linked through one key per position. For larger distances two linked loops must share one of
+    distance+1 segments exactly; each segment bucket keeps its loops grouped by clonotype, so a new loop is only
+    compared with clonotypes it has not joined yet.
+
+    19/10/2026 Original by agent
+    """
+
+    unique = {}
+    for loop in loops:
+        unique.setdefault(loop, len(unique))
+    unique_loops = list(unique)
+    parent = list(range(len(unique_loops)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    if distance == 1:
+        neighbours = {}
+        for i, loop in enumerate(unique_loops):
+            for p in range(len(loop)):
+                other = neighbours.setdefault((p, loop[:p] + loop[p+1:]), i) # bucketed by length as well as position
+                if find(other) != find(i):
+                    parent[find(other)] = find(i)
+    elif distance > 1:
+        segments = {}
+        for i, loop in enumerate(unique_loops):
+            k = len(loop)
+            parts = distance + 1
+            keys = [(k, j, loop[j*k//parts:(j+1)*k//parts]) for j in range(parts)]
+            if k <= distance:
+                keys = [(k,)] # loops this short are within distance of every other loop of the same length
+            for key in keys:
+                bucket = segments.setdefault(key, {}) # clonotype root: loops in this bucket
+                for root, members in list(bucket.items()):
+                    if find(root) != find(i) and any(within_hamming_distance(loop, unique_loops[other], distance) for other in members):
+                        parent[find(root)] = find(i)
+                groups = {}
+                for root, members in bucket.items(): # regroup after merging, appending the smaller group to the larger
+                    group = groups.setdefault(find(root), members)
+                    if group is not members:
+                        if len(group) < len(members):
+                            group, members = members, group
+                            groups[find(root)] = group
+                        group.extend(members)
+                groups.setdefault(find(i), []).append(i)
+                segments[key] = groups
+
+    clones = {}
+    return [clones.setdefault(find(unique[loop]), len(clones) + 1) for loop in loops]
+
+def write_clonotypes(path, members, distance=1):
+    """
+
+    Input: path     --- tab separated file to write clone assignments to
+           members  --- open temporary file of "antibody identifier<tab>CDRH3" lines of normal antibodies
+           distance --- largest Hamming distance between CDRH3s in one clonotype
+    Return: list of clonotype sizes, largest first
+
+    Members are kept on disk and read twice, so only the distinct CDRH3s are held in memory.
+
+    19/10/2026 Original by agent
+    """
+
+    members.seek(0)
+    loop_counts = collections.Counter(line.rstrip("\n").split("\t")[1] for line in members)
+    loop_clones = dict(zip(loop_counts, group_clonotypes(list(loop_counts), distance)))
+    sizes = collections.Counter()
+    for loop, count in loop_counts.items():
+        sizes[loop_clones[loop]] += count
+    members.seek(0)
+    with open(path, "w") as clonotypes:
+        clonotypes.write("identifier\tCDRH3\tclonotype\tclonotype_size\n")
+        for line in members:
+            identifier, loop = line.rstrip("\n").split("\t")
+            clonotypes.write("%s\t%s\t%d\t%d\n" % (identifier, loop, loop_clones[loop], sizes[loop_clones[loop]]))
+    return sorted(sizes.values(), reverse=True)
+
+#*********************************************************
+#*** Main program  ***
+#*********************************************************
+
+#Run Normal_chain_identifier on input sequences and run tally on normal and irregular sequences
+#Return results to display
+
+
+
+parser = argparse.ArgumentParser(description="Screen paired antibody light and heavy chains for normal chains")
+parser.add_argument("input", nargs="?", help="fasta-formatted file of paired light and heavy chains, - to read from stdin")
+parser.add_argument("--light", help="fasta-formatted file of light chains to join with --heavy on the identifier after |")
+parser.add_argument("--heavy", help="fasta-formatted file of heavy chains to join with --light on the identifier after |")
+parser.add_argument("--temp-dir", help="directory for the sorted runs written while joining --light and --heavy, and for --clonotypes")
+parser.add_argument("--output", help="file to write normal pairs to, - for stdout (default Initial_screening_output.txt, stdout when reading stdin)")
+parser.add_argument("--filtered", default="Initial_screening_filtered_out.txt", help="file to write irregular pairs to, e.g. /dev/fd/3")
+parser.add_argument("--sidecar", help="write per-pair chain features to this binary sidecar file")
+parser.add_argument("--from-sidecar", help="reclassify pairs from a sidecar file instead of parsing the input")
+parser.add_argument("--max-cdrh3-length", type=int, default=8, help="with --from-sidecar, CDRH3s up to this long are normal whatever the cysteine distance (default 8)")
+parser.add_argument("--cys-distance", type=int, nargs=2, default=[70, 80], metavar=("MIN", "MAX"), help="with --from-sidecar, heavy chain cysteine distances allowed for longer CDRH3s (default 70 80)")
+parser.add_argument("--index", action="store_true", help="build an identifier index of the input and exit")
+parser.add_argument("--fetch", nargs="+", metavar="ID", help="print the light and heavy chains of these identifiers using the index and exit")
+parser.add_argument("--warnings-file", help="write every pairing warning to this tab separated file")
+parser.add_argument("--jobs", type=int, default=1, help="number of worker processes to screen batches of pairs with")
+parser.add_argument("--max-memory", help="memory budget such as 800M or 4G that batches, workers and records must fit in")
+parser.add_argument("--sample", type=int, metavar="N", help="estimate the normal fraction from N randomly sampled pairs and exit")
+parser.add_argument("--seed", type=int, help="random seed for --sample")
+parser.add_argument("--duplicates", choices=("report", "drop"), help="check identifiers passed | are not repeated per chain type and report pairs that repeat one, or drop them")
+parser.add_argument("--database", help="SQLite database to record each pair's verdict, failure reason and CDRH3 in")
+parser.add_argument("--clonotypes", help="group normal antibodies into CDRH3 clonotypes and write the assignments to this file")
+parser.add_argument("--clonotype-distance", type=int, default=1, help="largest CDRH3 Hamming distance within a clonotype (default 1)")
+args = parser.parse_args()
+if not args.from_sidecar and (args.max_cdrh3_length != 8 or args.cys_distance != [70, 80]):
+    parser.error("--max-cdrh3-length and --cys-distance only apply with --from-sidecar")
+if bool(args.light) != bool(args.heavy):
+    parser.error("--light and --heavy must be given together")
+if bool(args.input) == bool(args.light):
+    parser.error("give either an input file or --light and --heavy")
+if args.light and args.sidecar:
+    parser.error("--sidecar needs a single input file")
+if args.clonotype_distance < 0:
+    parser.error("--clonotype-distance must be 0 or more")
+if args.from_sidecar and (args.database or args.clonotypes or args.duplicates or args.sidecar or args.jobs != 1
+                          or args.warnings_file or args.max_memory):
+    parser.error("--from-sidecar cannot be used with --database, --clonotypes, --duplicates, --sidecar, --jobs, "
+                 "--warnings-file or --max-memory")
+if args.output is None:
+    args.output = "-" if args.input == "-" else "Initial_screening_output.txt"
+if args.sample is not None and args.sample < 1:
+    parser.error("--sample needs at least 1 pair")
+if args.input in ("-", None) and (args.index or args.fetch or args.from_sidecar or args.sample):
+    sys.exit("ERROR: --index, --fetch, --from-sidecar and --sample need an input file")
+
+if args.index:
+    print("Indexed", build_index(args.input), "records in", index_path(args.input))
+    sys.exit()
+if args.sample is not None:
+    start = time.time()
+    Sampled_pairs, Normal_antibodies, Pair_bytes = sample_normal_fraction(args.input, args.sample, args.seed)
+    if Sampled_pairs == 0:
+        sys.exit("ERROR: no paired sequences found in " + args.input)
+    lower, upper = wilson_interval(Normal_antibodies, Sampled_pairs)
+    print("Sampled", Sampled_pairs, "pairs in %.1f seconds" % (time.time() - start))
+    print("Estimated normal fraction %.3f (95%% confidence interval %.3f - %.3f)" % (Normal_antibodies / Sampled_pairs, lower, upper))
+    print("Estimated", int(os.path.getsize(args.input) / Pair_bytes), "pairs in", args.input)
+    sys.exit()
+if args.fetch:
+    for fetch_id in args.fetch:
+        pairs = fetch_antibody(args.input, fetch_id)
+        if not pairs:
+            print("WARNING: " + fetch_id + " is not in the index", file=sys.stderr)
+        elif len(pairs) > 1:
+            print("WARNING: " + fetch_id + " is ambiguous, printing all", len(pairs), "pairs it names", file=sys.stderr)
+        for chains in pairs:
+            for chain in ("L", "H"):
+                if chain in chains:
+                    sys.stdout.write(chains[chain][0] + chains[chain][1])
+    sys.exit()
+
+Normal_antibodies = 0
+Irregular_antibodies = 0
+output = sys.stdout if args.output == "-" else open(args.output, 'w+')
+filtered = open(args.filtered, 'w+')
+log = sys.stderr if output is sys.stdout else sys.stdout # keep messages out of piped fasta
+if output is sys.stdout and hasattr(signal, "SIGPIPE"):
+    signal.signal(signal.SIGPIPE, signal.SIG_DFL) # exit quietly when downstream stops reading, e.g. | head
+if args.from_sidecar:
+    Normal_antibodies, Irregular_antibodies = reclassify_from_sidecar(args.from_sidecar, args.input, output, filtered,
+                                                                      args.max_cdrh3_length, *args.cys_distance)
+    filtered.close()
+    output.close()
+    print("You have entered", Normal_antibodies, "normal antibodies,  ", Irregular_antibodies ," irregular antibodies", file=log)
+    sys.exit()
+
+sidecar = None
+if args.sidecar:
+    sidecar = open(args.sidecar, "wb")
+    sidecar.write(SIDECAR_MAGIC + SIDECAR_HEADER.pack(*input_fingerprint(args.input or "-")))
+max_memory = parse_memory_size(args.max_memory) if args.max_memory else None
+plan = plan_memory(max_memory, args.jobs, bool(args.light), bool(args.database), bool(args.duplicates))
+if plan["jobs"] < args.jobs:
+    print("Screening in", plan["jobs"], "of the", args.jobs, "processes asked for to fit in --max-memory", file=log)
+clonotype_members = tempfile.TemporaryFile("w+", dir=args.temp_dir) if args.clonotypes else None
+diagnostics = new_diagnostics(args.warnings_file)
+input = None
+if args.light:
+    pairs = joined_records(args.light, args.heavy, diagnostics, plan["run_bytes"], args.temp_dir)
+else:
+    input = sys.stdin.buffer if args.input == "-" else open(args.input, 'rb')
+    pairs = paired_records(input, diagnostics, plan["record_bytes"])
+duplicate_check = None
+if args.duplicates:
+    duplicate_sources = [(args.light, "L"), (args.heavy, "H")] if args.light else [] if args.input == "-" else [(args.input, None)]
+    duplicate_check = new_duplicate_check(duplicate_sources, plan["duplicate_bytes"])
+    pairs = unique_pairs(pairs, duplicate_check, diagnostics, args.duplicates == "drop")
+database = None
+if args.database:
+    database = open_database(args.database)
+    database_rows = []
+    source = ",".join([args.light, args.heavy]) if args.light else args.input
+    screened_at = time.strftime("%Y-%m-%d %H:%M:%S")
+for pair, normal in screen_pairs(pairs, plan, log):
+    light_chain_identifier, light_chain, heavy_chain_identifier, heavy_chain, light_record, heavy_record = pair
+    if sidecar:
+        write_sidecar_row(sidecar, light_record, heavy_record, light_chain, heavy_chain)
+    if database:
+        database_rows.append(database_row(pair, normal, source, screened_at))
+        if len(database_rows) >= plan["database_rows"]:
+            write_database_rows(database, database_rows)
+    #If paired heavy and light chain are both "normal" then we consider them as one normal antibody
+    if normal:
+        output.write(light_chain_identifier) #Write normal antibody sequences to output in fasta format
+        output.write(re.sub('X','',light_chain)) #written light chain first to imput into modelling script
+        output.write(heavy_chain_identifier)
+        output.write(re.sub('X','',heavy_chain)) #Remove unidentified/deleted amino acids (X) from sequence before writing it otherwise modelling software will reject
+        Normal_antibodies += 1
+        if args.clonotypes:
+            clonotype_members.write(antibody_id(heavy_chain_identifier) + "\t" + CDRH3_sequence(re.sub('X','',heavy_chain).strip()) + "\n")
+    else:
+        filtered.write(light_chain_identifier) #Write irregular antibody sequences to filtered output file in fasta format
+        filtered.write(light_chain)
+        filtered.write(heavy_chain_identifier)
+        filtered.write(heavy_chain)
+        Irregular_antibodies += 1
+
+if input:
+    input.close()
+if database:
+    write_database_rows(database, database_rows)
+    database.close()
+output.close()
+filtered.close()
+if sidecar:
+    sidecar.close()
+print("You have entered", Normal_antibodies, "normal antibodies,  ", Irregular_antibodies ," irregular antibodies", file=log)
+print_diagnostics_summary(diagnostics, log)
+if duplicate_check:
+    print("Checked identifiers for duplicates using %.1f MB of fingerprints" % (duplicate_check_bytes(duplicate_check) / 1024 ** 2), file=log)
+if args.clonotypes:
+    clonotype_sizes = write_clonotypes(args.clonotypes, clonotype_members, args.clonotype_distance)
+    clonotype_members.close()
+    print("Grouped", Normal_antibodies, "normal antibodies into", len(clonotype_sizes), "CDRH3 clonotypes, largest sizes",
+          clonotype_sizes[:5], "- assignments in", args.clonotypes, file=log)
+if max_memory and not check_memory(max_memory, plan["jobs"], log):
+    sys.exit(1)